@@ -207,21 +207,23 @@ class Backtest(object):
 
         # since there is a dummy row at time 0, start backtest at date 1.
         # we must still update for t0
-        self.strategy.update(self.dates[0])
+        self.strategy.update(self.dates[0], inow=0)
 
         # and for the backtest loop, start at date 1
-        for dt in self.dates[1:]:
+        # pass the integer index along to avoid looking up the date on
+        # every update
+        for inow, dt in enumerate(self.dates[1:], 1):
             # update progress bar
             if self.progress_bar:
                 bar.update()
 
             # update strategy
-            self.strategy.update(dt)
+            self.strategy.update(dt, inow=inow)
 
             if not self.strategy.bankrupt:
                 self.strategy.run()
                 # need update after to save weights, values and such
-                self.strategy.update(dt)
+                self.strategy.update(dt, inow=inow)
             else:
                 if self.progress_bar:
                     bar.stop()
@@ -266,18 +268,10 @@ class Backtest(object):
         else:
             # get values for all securities in tree and divide by root values
             # for security weights
-            vals = {}
-            for m in self.strategy.members:
-                if isinstance(m, bt.core.SecurityBase):
-                    if self.strategy.fixed_income:
-                        m_values = m.notional_values
-                    else:
-                        m_values = m.values
-                    if m.name in vals:
-                        vals[m.name] += m_values
-                    else:
-                        vals[m.name] = m_values
-            vals = pd.DataFrame(vals)
+            if self.strategy.fixed_income:
+                vals = self.strategy.security_notional_values
+            else:
+                vals = self.strategy.security_values
 
             # divide by root strategy values
             if self.strategy.fixed_income:
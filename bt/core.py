@@ -2,8 +2,8 @@
 Contains the core building blocks of the framework.
 """
 from __future__ import division
-import math
 from copy import deepcopy
+from types import MethodType
 
 import pandas as pd
 import numpy as np
@@ -21,6 +21,63 @@ def is_zero( x ):
     return abs( x ) < TOL
 
 
+@cy.cfunc
+@cy.inline
+@cy.locals(x=cy.double, t=cy.double)
+@cy.returns(cy.double)
+def _floor( x ):
+    """
+    Floor of x that compiles down to a C cast instead of a call to math.floor
+    """
+    # covers NaN and inf - and doubles this large are integers already
+    if not abs( x ) < 4503599627370496.:
+        return x
+    t = cy.cast(cy.longlong, x)
+    # truncation rounds towards zero - step down for negative fractions
+    return t - (t > x)
+
+
+@cy.cfunc
+@cy.inline
+@cy.locals(x=cy.double)
+@cy.returns(cy.bint)
+def _isnan( x ):
+    """
+    NaN check for a scalar - NaN is the only value not equal to itself, so
+    this compiles down to a single comparison instead of a call to np.isnan
+    """
+    return x != x
+
+
+@cy.cfunc
+@cy.inline
+@cy.locals(q=cy.double, unit=cy.double, multiplier=cy.double,
+           bidoffer=cy.double, fee=cy.double)
+@cy.returns(cy.double)
+def _full_outlay( q, unit, multiplier, bidoffer, commission_fn ):
+    """
+    Same as SecurityBase.outlay(q)[0], without the method calls. unit is
+    price * multiplier and commission_fn is None when the commission is known
+    to be 0.
+    """
+    if commission_fn is None:
+        fee = 0.
+    else:
+        fee = commission_fn(q, unit)
+    return q * unit + abs(q) * 0.5 * bidoffer * multiplier + fee
+
+
+def _is_inherited( cls, base, name ):
+    """
+    True if cls uses base's implementation of method name, i.e. does not
+    override it. Compares the underlying functions - on Python 2 every
+    attribute lookup on a class returns a new unbound method.
+    """
+    m = getattr(cls, name)
+    b = getattr(base, name)
+    return getattr(m, '__func__', m) is getattr(b, '__func__', b)
+
+
 class Node(object):
 
     """
@@ -40,6 +97,7 @@ class Node(object):
         * root (Node): Root node of the tree (topmost node)
         * children (dict): Node's children
         * now (datetime): Used when backtesting to store current date
+        * inow (int): Integer location of now in the Node's data
         * stale (bool): Flag used to determine if Node is stale and need
             updating
         * prices (TimeSeries): Prices of the Node. Prices for a security will
@@ -67,10 +125,26 @@ class Node(object):
     _has_strat_children = cy.declare(cy.bint)
     _fixed_income = cy.declare(cy.bint)
 
+    # class level flag - cheaper than isinstance(x, StrategyBase)
+    _is_strategy = False
+
     def __init__(self, name, parent=None, children=None):
 
         self.name = name
 
+        # flags are set before anything else - adding this node to a parent
+        # below reads them
+        # is security flag - used to avoid updating 0 pos securities
+        self._issec = False
+
+        # fixed income flag - used to turn on notional weighing
+        self._fixed_income = False
+
+        # members caches - cleared when the tree changes
+        self._members = None
+        self._securities = None
+        self._run_order = None
+
         # strategy children helpers
         self._has_strat_children = False
         self._strat_children = []
@@ -91,7 +165,7 @@ class Node(object):
                     tmp = {}
                     ut = []
                     for c in children:
-                        if type(c) == str:
+                        if c.__class__ is str:
                             tmp[c] = Security(c)
                             ut.append(c)
                         else:
@@ -100,7 +174,7 @@ class Node(object):
 
                             # if strategy, turn on flag and add name to list
                             # strategy children have special treatment
-                            if isinstance(c, StrategyBase):
+                            if c._is_strategy:
                                 self._has_strat_children = True
                                 self._strat_children.append(c.name)
                             # if not strategy, then we will want to add this to
@@ -129,13 +203,14 @@ class Node(object):
             self._universe_tickers = None
         self.children = children
 
-        self._childrenv = list(children.values())
+        self._set_children_helpers()
         for c in self._childrenv:
             c.parent = self
             c.root = self.root
 
         # set default value for now
         self.now = 0
+        self.inow = 0
         # make sure root has stale flag
         # used to avoid unnecessary update
         # sometimes we change values in the tree and we know that we will need
@@ -150,12 +225,6 @@ class Node(object):
         self._weight = 0
         self._capital = 0
 
-        # is security flag - used to avoid updating 0 pos securities
-        self._issec = False
-
-        # fixed income flag - used to turn on notional weighing
-        self._fixed_income = False
-
     def __getitem__(self, key):
         return self.children[key]
 
@@ -235,6 +304,20 @@ class Node(object):
         """
         raise NotImplementedError()
 
+    def _cache_arrays(self):
+        """
+        Keeps references to the arrays underlying the Node's data Series -
+        update writes to these directly. Called by setup.
+        """
+        pass
+
+    def __setstate__(self, state):
+        # copies (deepcopy, pickle) get their own copies of the data Series,
+        # so the array caches have to be pointed at those again
+        self.__dict__.update(state)
+        if 'data' in state:
+            self._cache_arrays()
+
     def _add_child(self, child):
         child.parent = self
         child.root = self.root
@@ -245,7 +328,29 @@ class Node(object):
         else:
             self.children[child.name] = child
 
-        self._childrenv = list(self.children.values())
+        self._set_children_helpers()
+        self._invalidate_members()
+
+    def _set_children_helpers(self):
+        # snapshot children as tuples - iterated on every update. Securities
+        # and strategies are also split up so that update does not have to
+        # check each child's type
+        self._childrenv = tuple(self.children.values())
+        self._sec_children = tuple(c for c in self._childrenv if c._issec)
+        self._strat_children_nodes = tuple(c for c in self._childrenv
+                                           if not c._issec)
+
+    def _invalidate_members(self):
+        # the tree changed - clear members caches for this node and all of
+        # its ancestors
+        node = self
+        while True:
+            node._members = None
+            node._securities = None
+            node._run_order = None
+            if node.parent is node:
+                break
+            node = node.parent
 
     def update(self, date, data=None, inow=None):
         """
@@ -271,10 +376,17 @@ class Node(object):
         Node members. Members include current node as well as Node's
         children.
         """
-        res = [self]
-        for c in list(self.children.values()):
-            res.extend(c.members)
-        return res
+        # the tree rarely changes once built - flatten it once (iteratively,
+        # depth-first) and cache the result
+        if self._members is None:
+            res = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                res.append(node)
+                stack.extend(reversed(node._childrenv))
+            self._members = tuple(res)
+        return list(self._members)
 
     @property
     def full_name(self):
@@ -332,6 +444,9 @@ class StrategyBase(Node):
         * prices (TimeSeries): Prices of the Strategy - basically an index that
             reflects the value of the strategy over time.
         * outlays (DataFrame): Outlays for each SecurityBase child
+        * security_values (DataFrame): Values of all securities in the tree
+        * security_notional_values (DataFrame): Notional values of all
+            securities in the tree
         * price (float): last price
         * value (float): last value
         * notional_value (float): last notional value
@@ -360,8 +475,11 @@ class StrategyBase(Node):
     _last_fee = cy.declare(cy.double)
     _paper_trade = cy.declare(cy.bint)
     _bidoffer_set = cy.declare(cy.bint)
+    _dflt_comm = cy.declare(cy.bint)
     bankrupt = cy.declare(cy.bint)    
 
+    _is_strategy = True
+
     def __init__(self, name, children=None, parent=None):
         Node.__init__(self, name, children=children, parent=parent)
         self._capital = 0
@@ -385,6 +503,22 @@ class StrategyBase(Node):
         self._positions = None
         self.bankrupt = False
 
+    @property
+    def commission_fn(self):
+        """
+        Commission (transaction fee) function - fn(quantity, price).
+        """
+        return self._commission_fn
+
+    @commission_fn.setter
+    def commission_fn(self, fn):
+        self._commission_fn = fn
+        # flag the default (zero) commission function so that securities can
+        # skip calling it altogether - unless a subclass overrides it
+        self._dflt_comm = (
+            fn == self._dflt_comm_fn and
+            _is_inherited(type(self), StrategyBase, '_dflt_comm_fn'))
+
     @property
     def price(self):
         """
@@ -401,7 +535,7 @@ class StrategyBase(Node):
         """
         if self.root.stale:
             self.root.update(self.now, None)
-        return self._prices.loc[:self.now]
+        return self._prices.iloc[:self.inow + 1]
 
     @property
     def values(self):
@@ -410,7 +544,7 @@ class StrategyBase(Node):
         """
         if self.root.stale:
             self.root.update(self.now, None)
-        return self._values.loc[:self.now]
+        return self._values.iloc[:self.inow + 1]
 
     @property
     def notional_values(self):
@@ -419,7 +553,7 @@ class StrategyBase(Node):
         """
         if self.root.stale:
             self.root.update(self.now, None)
-        return self._notl_values.loc[:self.now]
+        return self._notl_values.iloc[:self.inow + 1]
 
     @property
     def capital(self):
@@ -443,7 +577,7 @@ class StrategyBase(Node):
         TimeSeries of fees.
         """
         # no stale check needed
-        return self._fees.loc[:self.now]
+        return self._fees.iloc[:self.inow + 1]
 
     @property
     def bidoffer_paid( self ):
@@ -451,7 +585,7 @@ class StrategyBase(Node):
         TimeSeries of bid/offer spread paid on transactions in the current step
         """
         if self._bidoffer_set:            
-            return self._bidoffer_paid.loc[:self.now]
+            return self._bidoffer_paid.iloc[:self.inow + 1]
         else:
             raise Exception( 'no bid/offer spreads provided during setup' )
 
@@ -465,11 +599,11 @@ class StrategyBase(Node):
         # avoid windowing every time
         # if calling and on same date return
         # cached value
-        if self.now == self._last_chk:
+        if self.inow == self._last_chk:
             return self._funiverse
         else:
-            self._last_chk = self.now
-            self._funiverse = self._universe.loc[:self.now]
+            self._last_chk = self.inow
+            self._funiverse = self._universe.iloc[:self.inow + 1]
             return self._funiverse
 
     @property
@@ -477,7 +611,10 @@ class StrategyBase(Node):
         """
         Returns a list of children that are of type SecurityBase
         """
-        return [x for x in self.members if isinstance(x, SecurityBase)]
+        if self._securities is None:
+            self._securities = tuple(x for x in self.members
+                                     if isinstance(x, SecurityBase))
+        return list(self._securities)
 
     @property
     def outlays(self):
@@ -488,23 +625,63 @@ class StrategyBase(Node):
             self.root.update(self.root.now, None)
         return pd.DataFrame({x.name: x.outlays for x in self.securities})
 
-    @property
-    def positions(self):
-        """
-        TimeSeries of positions.
-        """
+    def _securities_matrix(self, attr):
+        # DataFrame of a per-security array attribute (e.g. '_positions_arr')
+        # with a column per security name - securities that appear in
+        # multiple children are summed up. Shared by positions,
+        # security_values and security_notional_values
+
         # if accessing and stale - update first
         if self.root.stale:
             self.root.update(self.root.now, None)
 
-        vals = pd.DataFrame()
-        for x in self.members:
-            if isinstance(x, SecurityBase):
-                vals[x.name] = x.positions + (vals[x.name] if x.name in vals.columns else 0)
+        securities = self.securities
+
+        cols = {}
+        for x in securities:
+            if x.name not in cols:
+                cols[x.name] = len(cols)
+
+        if not cols:
+            return pd.DataFrame()
+
+        # fill one preallocated matrix rather than assembling the
+        # DataFrame column by column
+        data = np.zeros((len(self.data.index), len(cols)))
+        for x in securities:
+            # same checks as the security's values properties
+            if x._needupdate or x.now != x.parent.now:
+                x.update(self.root.now)
+            data[:, cols[x.name]] += getattr(x, attr)
+
+        return pd.DataFrame(data, index=self.data.index,
+                            columns=list(cols)).iloc[:self.inow + 1]
 
+    @property
+    def positions(self):
+        """
+        TimeSeries of positions.
+        """
+        vals = self._securities_matrix('_positions_arr')
         self._positions = vals
         return vals
 
+    @property
+    def security_values(self):
+        """
+        DataFrame of the values of all securities in the tree - securities
+        that appear in multiple children are summed up.
+        """
+        return self._securities_matrix('_values_arr')
+
+    @property
+    def security_notional_values(self):
+        """
+        DataFrame of the notional values of all securities in the tree -
+        securities that appear in multiple children are summed up.
+        """
+        return self._securities_matrix('_notl_values_arr')
+
     def setup(self, universe, **kwargs):
         """
         Setup strategy with universe. This will speed up future calculations
@@ -528,10 +705,7 @@ class StrategyBase(Node):
             self._paper_trade = True
             self._paper_amount = 1000000
 
-            paper = deepcopy(self)
-            paper.parent = paper
-            paper.root = paper
-            paper._paper_trade = False
+            paper = self._make_paper()
             paper.setup(self._original_data, **kwargs)
             paper.adjust(self._paper_amount)
             self._paper = paper
@@ -545,16 +719,26 @@ class StrategyBase(Node):
             valid_filter = list(set(universe.columns)
                                 .intersection(self._universe_tickers))
 
-            funiverse = universe[valid_filter].copy()
-
             # if we have strat children, we will need to create their columns
             # in the new universe
             if self._has_strat_children:
-                for c in self._strat_children:
-                    funiverse[c] = np.nan
-
-            # must create to avoid pandas warning
-            funiverse = pd.DataFrame(funiverse)
+                # strategy children columns start out empty, even if the
+                # universe happens to have columns with the same names
+                src = universe
+                clash = src.columns.intersection(self._strat_children)
+                if len(clash) > 0:
+                    src = src.drop(columns=clash)
+
+                # filter and add the (NaN) strategy children columns in one
+                # go. Copy to consolidate - the strategy children columns are
+                # written to through their underlying arrays during updates,
+                # so we need their memory to stay put
+                funiverse = src.reindex(
+                    columns=valid_filter + self._strat_children).copy()
+            else:
+                # selecting columns already creates new data - just wrap it
+                # in a new DataFrame to avoid pandas warning
+                funiverse = pd.DataFrame(universe[valid_filter])
 
         self._universe = funiverse
         # holds filtered universe
@@ -580,13 +764,38 @@ class StrategyBase(Node):
             self.data['bidoffer_paid'] = 0.
             self._bidoffer_paid = self.data['bidoffer_paid']
 
+        self._cache_arrays()
+
         # setup children as well - use original universe here - don't want to
         # pollute with potential strategy children in funiverse
         if self.children is not None:
             [c.setup(universe, **kwargs) for c in self._childrenv]
 
+    def _cache_arrays(self):
+        """
+        Keeps references to the arrays underlying the Strategy's data Series
+        and the strategy children columns of the universe - update writes to
+        these directly to avoid going through pandas on every bar.
+        """
+        self._prices_arr = self._prices.values
+        self._values_arr = self._values.values
+        self._notl_values_arr = self._notl_values.values
+        self._cash_arr = self._cash.values
+        self._fees_arr = self._fees.values
+
+        if self._bidoffer_set:
+            self._bidoffer_paid_arr = self._bidoffer_paid.values
+
+        # (node, column array) pairs for the strategy children so that
+        # update can write their prices without any lookups
+        if self._has_strat_children:
+            self._strat_children_arrs = tuple(
+                (self.children[c], self._universe[c].values)
+                for c in self._strat_children)
+
     @cy.locals(newpt=cy.bint, val=cy.double, ret=cy.double, coupons=cy.double,
-               notl_val=cy.double, bidoffer_paid=cy.double)
+               notl_val=cy.double, bidoffer_paid=cy.double, total=cy.double,
+               pnl=cy.double, bottom=cy.double)
     def update(self, date, data=None, inow=None):
         """
         Update strategy. Updates prices, values, weight, etc.
@@ -614,6 +823,7 @@ class StrategyBase(Node):
                 inow = 0
             else:
                 inow = self.data.index.get_loc(date)
+        self.inow = inow
 
         # update children if any and calculate value
         val = self._capital  # default if no children
@@ -622,22 +832,32 @@ class StrategyBase(Node):
         bidoffer_paid = 0.
         coupons = 0
         if self.children is not None:
-            for c in self._childrenv:
+            # children are brought up to date right before their values are
+            # read, so we can skip the stale checks of the value properties
+            for c in self._sec_children:
                 # Sweep up cash from the security nodes (from coupon payments, etc)
-                if c._issec and newpt:
+                if newpt:
                     coupons += c._capital
                     c._capital = 0
 
                 # avoid useless update call
-                if c._issec and not c._needupdate:
+                if not c._needupdate:
                     continue
                 c.update(date, data, inow)
-                val += c.value
+                val += c._value
                 # Strategies always have positive notional value
-                notl_val += abs( c.notional_value )
+                notl_val += abs( c._notl_value )
 
                 if self._bidoffer_set:
-                    bidoffer_paid += c.bidoffer_paid.values[inow]
+                    bidoffer_paid += c._bidoffer_paid_arr[inow]
+
+            for c in self._strat_children_nodes:
+                c.update(date, data, inow)
+                val += c._value
+                notl_val += abs( c._notl_value )
+
+                if self._bidoffer_set:
+                    bidoffer_paid += c._bidoffer_paid_arr[inow]
 
         self._capital += coupons
         val += coupons
@@ -653,13 +873,13 @@ class StrategyBase(Node):
         # won't change
         if newpt or not is_zero( self._value - val ) or not is_zero( self._notl_value - notl_val ):
             self._value = val
-            self._values.values[inow] = val
+            self._values_arr[inow] = val
 
             self._notl_value = notl_val
-            self._notl_values.values[inow] = notl_val
+            self._notl_values_arr[inow] = notl_val
 
             if self._bidoffer_set:
-                self._bidoffer_paid.values[inow] = bidoffer_paid
+                self._bidoffer_paid_arr[inow] = bidoffer_paid
 
             if self.fixed_income:
                 # For notional weights, we compute additive return
@@ -683,12 +903,12 @@ class StrategyBase(Node):
                                                  pnl))
 
                 self._price = self._last_price + ret
-                self._prices.values[inow] = self._price
+                self._prices_arr[inow] = self._price
 
             else:
                 bottom = self._last_value + self._net_flows
                 if not is_zero( bottom ):
-                    ret = self._value / (self._last_value + self._net_flows) - 1
+                    ret = self._value / bottom - 1
                 else:
                     if is_zero( self._value ):
                         ret = 0
@@ -705,46 +925,59 @@ class StrategyBase(Node):
                                                  self._value))
 
                 self._price = self._last_price * (1 + ret)
-                self._prices.values[inow] = self._price
+                self._prices_arr[inow] = self._price
 
         # update children weights
         if self.children is not None:
-            for c in self._childrenv:
-                # avoid useless update call
-                if c._issec and not c._needupdate:
-                    continue
-
-                if self.fixed_income:
-                    if not is_zero( notl_val ):
-                        c._weight = c.notional_value / notl_val
-                    else:
-                        c._weight = 0.0
-                else:
-                    if not is_zero( val ):
-                        c._weight = c.value / val
-                    else:
+            # weights are based off notional value for fixed income
+            if self.fixed_income:
+                total = notl_val
+            else:
+                total = val
+
+            # decide on the case once rather than for every child, and go
+            # through securities and strategies separately so that only
+            # securities pay for the needupdate check (securities that were
+            # not updated keep their weight)
+            if is_zero( total ):
+                for c in self._sec_children:
+                    if c._needupdate:
                         c._weight = 0.0
+                for c in self._strat_children_nodes:
+                    c._weight = 0.0
+            elif self.fixed_income:
+                for c in self._sec_children:
+                    if c._needupdate:
+                        c._weight = c.notional_value / total
+                for c in self._strat_children_nodes:
+                    c._weight = c.notional_value / total
+            else:
+                for c in self._sec_children:
+                    if c._needupdate:
+                        c._weight = c.value / total
+                for c in self._strat_children_nodes:
+                    c._weight = c.value / total
 
         # if we have strategy children, we will need to update them in universe
         if self._has_strat_children:
-            for c in self._strat_children:
-                # TODO: optimize ".loc" here as well
-                self._universe.loc[date, c] = self.children[c].price
+            for c, arr in self._strat_children_arrs:
+                # children were updated above - no need to go through price
+                arr[inow] = c._price
 
         # Cash should track the unallocated capital at the end of the day, so
         # we should update it every time we call "update".
         # Same for fees
-        self._cash.values[inow] = self._capital
-        self._fees.values[inow] = self._last_fee
+        self._cash_arr[inow] = self._capital
+        self._fees_arr[inow] = self._last_fee
 
         # update paper trade if necessary
         if newpt and self._paper_trade:
-            self._paper.update(date)
+            self._paper.update(date, inow=inow)
             self._paper.run()
-            self._paper.update(date)
+            self._paper.update(date, inow=inow)
             # update price
             self._price = self._paper.price
-            self._prices.values[inow] = self._price
+            self._prices_arr[inow] = self._price
 
     @cy.locals(amount=cy.double, update=cy.bint, flow=cy.bint, fees=cy.double)
     def adjust(self, amount, update=True, flow=True, fee=0.0):
@@ -820,8 +1053,8 @@ class StrategyBase(Node):
             # push allocation down to children if any
             # use _weight to avoid triggering an update
             if self.children is not None:
-                [c.allocate(amount * c._weight, update=False)
-                 for c in self._childrenv]
+                for c in self._childrenv:
+                    c.allocate(amount * c._weight, update=False)
 
             # mark as stale if update requested
             if update:
@@ -854,8 +1087,8 @@ class StrategyBase(Node):
             # push allocation down to children if any
             # use _weight to avoid triggering an update
             if self.children is not None:
-                [c.transact(q * c._weight, update=False)
-                 for c in self._childrenv]
+                for c in self._childrenv:
+                    c.transact(q * c._weight, update=False)
 
             # mark as stale if update requested
             if update:
@@ -894,7 +1127,7 @@ class StrategyBase(Node):
                 return
 
         # if no base specified use self's value
-        if np.isnan(base):
+        if _isnan( base ):
             if self.fixed_income:
                 base = self.notional_value
             else:
@@ -925,7 +1158,7 @@ class StrategyBase(Node):
             delta = weight - c.weight
             c.allocate(delta * base, update = update)
 
-    @cy.locals(update=cy.bint)
+    @cy.locals(update=cy.bint, value=cy.double)
     def close(self, child, update=True):
         """
         Close a child position - alias for rebalance(0, child). This will also
@@ -943,18 +1176,39 @@ class StrategyBase(Node):
             if c.position != 0.:
                 c.transact(-c.position, update = update)
         else:
-            if c.value != 0. and not np.isnan(c.value):
-                c.allocate(-c.value, update = update)
+            value = c.value
+            if value != 0. and not _isnan( value ):
+                c.allocate(-value, update = update)
 
+    @cy.locals(proceeds=cy.double, fees=cy.double)
     def flatten(self):
         """
         Close all child positions.
         """
-        # go right to base alloc
+        # securities are closed out directly, and their proceeds and fees
+        # are passed to adjust in one go instead of once per security
+        proceeds = 0.
+        fees = 0.
+        for c in self._sec_children:
+            if self.fixed_income:
+                if c.position == 0:
+                    continue
+            elif c.value == 0:
+                continue
+            full_outlay, fee = c._close_out()
+            proceeds -= full_outlay
+            fees += fee
+        self.adjust(proceeds, update=False, flow=False, fee=fees)
+
+        # go right to base alloc for strategies
         if self.fixed_income:
-            [c.transact(-c.position, update=False) for c in self._childrenv if c.position != 0]
+            for c in self._strat_children_nodes:
+                if c.position != 0:
+                    c.transact(-c.position, update=False)
         else:
-            [c.allocate(-c.value, update=False) for c in self._childrenv if c.value != 0]
+            for c in self._strat_children_nodes:
+                if c.value != 0:
+                    c.allocate(-c.value, update=False)
 
         self.root.stale = True
 
@@ -985,6 +1239,26 @@ class StrategyBase(Node):
     def _dflt_comm_fn(self, q, p):
         return 0.
 
+    def _make_paper(self):
+        """
+        Create a detached copy of this strategy (and its children) to be used
+        for paper trading.
+        """
+        # only copy this strategy's sub-tree - by seeding the memo, the
+        # parent and root are not copied along (with all their data), and the
+        # setup data is shared rather than duplicated
+        memo = {id(self.parent): None, id(self.root): None,
+                id(self._original_data): self._original_data}
+        for v in self._setup_kwargs.values():
+            memo[id(v)] = v
+
+        paper = deepcopy(self, memo)
+        paper.parent = paper
+        for m in paper.members:
+            m.root = paper
+        paper._paper_trade = False
+        return paper
+
     def _create_child_if_needed(self, child):
         if child not in self.children:
             c = Security(child)
@@ -1039,6 +1313,7 @@ class SecurityBase(Node):
     _bidoffer = cy.declare(cy.double)
     _last_bidoffer = cy.declare(cy.double)
     _bidoffer_set = cy.declare(cy.bint)
+    _inline_outlay = cy.declare(cy.bint)
 
     @cy.locals(multiplier=cy.double)
     def __init__(self, name, multiplier=1):
@@ -1058,6 +1333,12 @@ class SecurityBase(Node):
         self._last_bidoffer = 0
         self._bidoffer_set = False
 
+        # allocate can only work out outlays inline if the fee model is the
+        # default one - subclasses may override outlay or commission
+        self._inline_outlay = (
+            _is_inherited(type(self), SecurityBase, 'outlay') and
+            _is_inherited(type(self), SecurityBase, 'commission'))
+
     @property
     def price(self):
         """
@@ -1076,7 +1357,7 @@ class SecurityBase(Node):
         # if accessing and stale - update first
         if self._needupdate or self.now != self.parent.now:
             self.update(self.root.now)
-        return self._prices.loc[:self.now]
+        return self._prices.iloc[:self.inow + 1]
 
     @property
     def values(self):
@@ -1088,7 +1369,7 @@ class SecurityBase(Node):
             self.update(self.root.now)
         if self.root.stale:
             self.root.update(self.root.now, None)
-        return self._values.loc[:self.now]
+        return self._values.iloc[:self.inow + 1]
 
     @property
     def notional_values(self):
@@ -1100,7 +1381,7 @@ class SecurityBase(Node):
             self.update(self.root.now)
         if self.root.stale:
             self.root.update(self.root.now, None)
-        return self._notl_values.loc[:self.now]
+        return self._notl_values.iloc[:self.inow + 1]
 
     @property
     def position(self):
@@ -1120,7 +1401,7 @@ class SecurityBase(Node):
             self.update(self.root.now)
         if self.root.stale:
             self.root.update(self.root.now, None)
-        return self._positions.loc[:self.now]
+        return self._positions.iloc[:self.inow + 1]
 
     @property
     def outlays(self):
@@ -1135,7 +1416,7 @@ class SecurityBase(Node):
             self.update(self.root.now)
         if self.root.stale:
             self.root.update(self.root.now, None)
-        return self._outlays.loc[:self.now]
+        return self._outlays.iloc[:self.inow + 1]
 
     @property
     def bidoffer(self):
@@ -1156,7 +1437,7 @@ class SecurityBase(Node):
             # if accessing and stale - update first
             if self._needupdate or self.now != self.parent.now:
                 self.update(self.root.now)
-            return self._bidoffers.loc[:self.now]
+            return self._bidoffers.iloc[:self.inow + 1]
         else:
             raise Exception( 'no bid/offer spreads provided during setup' )
 
@@ -1171,7 +1452,7 @@ class SecurityBase(Node):
                 self.update(self.root.now)
             if self.root.stale:
                 self.root.update(self.root.now, None)
-            return self._bidoffer_paid.loc[:self.now]
+            return self._bidoffer_paid.iloc[:self.inow + 1]
         else:
             raise Exception( 'no bid/offer spreads provided during setup' )
 
@@ -1201,7 +1482,8 @@ class SecurityBase(Node):
             self._prices_set = True
         else:
             self.data = pd.DataFrame(index=universe.index,
-                                     columns=['price', 'value', 'position', 'notional_value'])
+                                     columns=['price', 'value', 'position', 'notional_value'],
+                                     data=np.nan)
             self._prices = self.data['price']
             self._prices_set = False
 
@@ -1234,7 +1516,29 @@ class SecurityBase(Node):
             self.data['bidoffer_paid'] = 0.
             self._bidoffer_paid = self.data['bidoffer_paid']
 
-    @cy.locals(prc=cy.double)
+        self._cache_arrays()
+
+    def _cache_arrays(self):
+        """
+        Keeps references to the arrays underlying the Security's data Series -
+        update writes to these directly to avoid going through pandas on
+        every bar.
+        """
+        # prices are read as float64 even if the universe holds other types
+        # (ints for example) - this is only a copy when prices come from the
+        # universe, in which case they are never written to
+        self._prices_arr = np.asarray(self._prices.values, dtype=np.float64)
+        self._values_arr = self._values.values
+        self._notl_values_arr = self._notl_values.values
+        self._positions_arr = self._positions.values
+        self._outlays_arr = self._outlays.values
+
+        if self._bidoffer_set:
+            self._bidoffers_arr = self._bidoffers.values
+            self._bidoffer_paid_arr = self._bidoffer_paid.values
+
+    @cy.locals(prc=cy.double, price=cy.double, position=cy.double,
+               newdt=cy.bint)
     def update(self, date, data=None, inow=None):
         """
         Update security with a given date and optionally, some data.
@@ -1244,7 +1548,9 @@ class SecurityBase(Node):
         # do. Internal calls (stale root calls) have None data. Also want to
         # make sure date has not changed, because then we do indeed want to
         # update.
-        if date == self.now and self._last_pos == self._position:
+        # compare dates only once - Timestamp comparisons are not free
+        newdt = date != self.now
+        if not newdt and self._last_pos == self._position:
             return
 
         if inow is None:
@@ -1254,56 +1560,69 @@ class SecurityBase(Node):
                 inow = self.data.index.get_loc(date)
 
         # date change - update price
-        if date != self.now:
+        if newdt:
             # update now
             self.now = date
+            self.inow = inow
 
             if self._prices_set:
-                self._price = self._prices.values[inow]
+                self._price = self._prices_arr[inow]
             # traditional data update
             elif data is not None:
                 prc = data[self.name]
                 self._price = prc
-                self._prices.values[inow] = prc
+                self._prices_arr[inow] = prc
 
             #update bid/offer
             if self._bidoffer_set:
-                self._bidoffer = self._bidoffers.values[inow]
+                self._bidoffer = self._bidoffers_arr[inow]
 
-        self._positions.values[inow] = self._position
-        self._last_pos = self._position
+        # work on typed locals - avoids repeated attribute lookups
+        position = self._position
+        price = self._price
 
-        if np.isnan(self._price):
-            if is_zero( self._position ):
+        self._positions_arr[inow] = position
+        self._last_pos = position
+
+        if _isnan( price ):
+            if is_zero( position ):
                 self._value = 0
             else:
                 raise Exception(
                     'Position is open (non-zero: %s) and latest price is NaN '
-                    'for security %s on %s. Cannot update node value.' % (self._position, self.name, date))
+                    'for security %s on %s. Cannot update node value.' % (position, self.name, date))
         else:
-            self._value = self._position * self._price * self.multiplier
+            self._value = position * price * self.multiplier
 
         self._notl_value = self._value
 
-        self._values.values[inow] = self._value
-        self._notl_values.values[inow] = self._notl_value
+        self._values_arr[inow] = self._value
+        self._notl_values_arr[inow] = self._notl_value
 
-        if is_zero( self._weight ) and is_zero( self._position ):
+        if is_zero( self._weight ) and is_zero( position ):
             self._needupdate = False
 
         # save outlay to outlays
         if self._outlay != 0:
-            self._outlays.values[inow] += self._outlay
+            self._outlays_arr[inow] += self._outlay
             # reset outlay back to 0
             self._outlay = 0
 
         if self._last_bidoffer != 0:
-            self._bidoffer_paid.values[inow] += self._last_bidoffer
+            self._bidoffer_paid_arr[inow] += self._last_bidoffer
             # reset last_bidoffer back to 0
             self._last_bidoffer = 0
 
     @cy.locals(amount=cy.double, update=cy.bint, q=cy.double, outlay=cy.double,
-               i=cy.int)
+               i=cy.int, price=cy.double, full_outlay=cy.double,
+               full_outlay_of_1_more=cy.double, last_q=cy.double,
+               last_amount_short=cy.double,
+               dq_wout_considering_tx_costs=cy.double, going_long=cy.bint,
+               sign=cy.double, unit=cy.double, position=cy.double,
+               inline_outlay=cy.bint)
+    # the only divisions are by price * multiplier, and a zero price is
+    # rejected before we get there
+    @cy.cdivision(True)
     def allocate(self, amount, update=True):
         """
         This allocates capital to the Security. This is the method used to
@@ -1340,30 +1659,35 @@ class SecurityBase(Node):
             raise Exception(
                 'Cannot allocate capital to a parentless security')
 
-        if is_zero( self._price ) or np.isnan(self._price):
-            raise Exception(
-                'Cannot allocate capital to '
-                '%s because price is %s as of %s'
-                % (self.name, self._price, self.parent.now))
+        price = self._price
+        if is_zero( price ) or _isnan( price ):
+            self._raise_price_error()
+
+        # the position does not change until we transact - read it once
+        position = self._position
 
         # buy/sell
         # determine quantity - must also factor in commission
-        # closing out?
+        # closing out? the quantity is known then - straight to transact,
+        # which ignores a zero quantity
         if is_zero( amount + self._value ):
-            q = -self._position
-        else:
-            q = amount / (self._price * self.multiplier)
-            if self.integer_positions:
-                if (self._position > 0) or ( is_zero(self._position) and (
-                        amount > 0)):
-                    # if we're going long or changing long position
-                    q = math.floor(q)
-                else:
-                    # if we're going short or changing short position
-                    q = math.ceil(q)
+            self.transact( -position, update, False )
+            return
+
+        # value of one unit of the security - used throughout below
+        unit = price * self.multiplier
+        q = amount / unit
+        if self.integer_positions:
+            # if we're going long or changing long position we round down,
+            # if we're going short or changing short position we round up.
+            # ceil(q) == -floor(-q), so both come down to a single floor
+            going_long = (position > 0) or (
+                is_zero(position) and (amount > 0))
+            sign = 1. if going_long else -1.
+            q = sign * _floor(sign * q)
 
         # if q is 0 nothing to do
-        if is_zero( q ) or np.isnan(q):
+        if is_zero( q ) or _isnan( q ):
             return
 
         # unless we are closing out a position (q == -position)
@@ -1379,8 +1703,21 @@ class SecurityBase(Node):
         # sell additional units to fund this requirement. As such, q must once
         # again decrease.
         #
-        if not q == -self._position:
-            full_outlay, _, _, _ = self.outlay(q)
+        if not q == -position:
+            # the full outlay is worked out inline rather than through
+            # self.outlay, which would go through commission and then
+            # commission_fn on every step of the search below. Not possible
+            # if outlay or commission are overridden
+            inline_outlay = self._inline_outlay
+            if self.parent._dflt_comm:
+                commission_fn = None
+            else:
+                commission_fn = self.parent.commission_fn
+            if inline_outlay:
+                full_outlay = _full_outlay(q, unit, self.multiplier,
+                                           self._bidoffer, commission_fn)
+            else:
+                full_outlay = self.outlay(q)[0]
 
             # if full outlay > amount, we must decrease the magnitude of `q`
             # this can potentially lead to an infinite loop if the commission
@@ -1398,15 +1735,21 @@ class SecurityBase(Node):
             i = 0
             last_q = q
             last_amount_short = full_outlay - amount
-            while not np.isclose(full_outlay, amount, rtol=0.) and q != 0:
+            # same test as np.isclose(full_outlay, amount, rtol=0.), without
+            # the array machinery
+            while not abs(full_outlay - amount) <= 1e-8 and q != 0:
 
-                dq_wout_considering_tx_costs = (full_outlay - amount)/(self._price * self.multiplier)
+                dq_wout_considering_tx_costs = (full_outlay - amount) / unit
                 q = q - dq_wout_considering_tx_costs
 
                 if self.integer_positions:
-                    q = math.floor(q)
+                    q = _floor(q)
 
-                full_outlay, _, _, _ = self.outlay(q)
+                if inline_outlay:
+                    full_outlay = _full_outlay(q, unit, self.multiplier,
+                                               self._bidoffer, commission_fn)
+                else:
+                    full_outlay = self.outlay(q)[0]
 
                 # if our q is too low and we have integer positions
                 # then we know that the correct quantity is the one  where
@@ -1414,7 +1757,12 @@ class SecurityBase(Node):
                 # position then we wouldn't have enough cash
                 if self.integer_positions:
 
-                    full_outlay_of_1_more, _, _, _ = self.outlay(q + 1)
+                    if inline_outlay:
+                        full_outlay_of_1_more = _full_outlay(
+                            q + 1, unit, self.multiplier, self._bidoffer,
+                            commission_fn)
+                    else:
+                        full_outlay_of_1_more = self.outlay(q + 1)[0]
 
                     if full_outlay < amount and full_outlay_of_1_more > amount:
                         break
@@ -1441,7 +1789,7 @@ class SecurityBase(Node):
                     )
                 last_q = q
 
-                if np.abs(full_outlay - amount) > np.abs(last_amount_short):
+                if abs(full_outlay - amount) > abs(last_amount_short):
                     raise Exception(
                         'The difference between what we have raised with q and'
                         ' the amount we are trying to raise has gotten bigger since'
@@ -1453,8 +1801,15 @@ class SecurityBase(Node):
 
         self.transact( q, update, False )
 
-    @cy.locals(q=cy.double, update=cy.bint, update_self=cy.bint, outlay=cy.double,
-               bidoffer=cy.double)
+    def _raise_price_error(self):
+        # kept out of allocate - the error path is cold
+        raise Exception(
+            'Cannot allocate capital to '
+            '%s because price is %s as of %s'
+            % (self.name, self._price, self.parent.now))
+
+    @cy.locals(q=cy.double, update=cy.bint, update_self=cy.bint,
+               full_outlay=cy.double, fee=cy.double)
     def transact(self, q, update=True, update_self=True, price=None):
         """
         This transacts the Security. This is the method used to
@@ -1478,13 +1833,27 @@ class SecurityBase(Node):
             self.update(self.parent.now)
 
         # if q is 0 nothing to do
-        if is_zero(q) or np.isnan(q):
+        if is_zero(q) or _isnan(q):
             return
 
         if price is not None and not self._bidoffer_set:
             raise ValueError('Cannot transact at custom prices when "bidoffer" has '
                              'not been passed during setup to enable bid-offer tracking.')
 
+        full_outlay, fee = self._book_transaction(q, price)
+
+        # call parent - positional args (amount, update, flow, fee) so no
+        # kwargs dict needs to be built on every trade
+        self.parent.adjust(-full_outlay, update, False, fee)
+
+    @cy.locals(q=cy.double, full_outlay=cy.double, outlay=cy.double,
+               fee=cy.double, bidoffer=cy.double)
+    def _book_transaction(self, q, price=None):
+        """
+        Books a transaction of quantity q on the security, without passing the
+        proceeds up to the parent. Returns the full outlay and the fee that
+        the parent needs to be adjusted by.
+        """
         # this security will need an update, even if pos is 0 (for example if
         # we close the positions, value and pos is 0, but still need to do that
         # last update)
@@ -1503,8 +1872,22 @@ class SecurityBase(Node):
         self._outlay += outlay
         self._last_bidoffer += bidoffer
 
-        # call parent
-        self.parent.adjust(-full_outlay, update=update, flow=False, fee=fee)
+        return full_outlay, fee
+
+    def _close_out(self):
+        """
+        Closes out the position, without passing the proceeds up to the
+        parent. Used by the parent's flatten, which adjusts once for all of its
+        securities. Returns the full outlay and the fee.
+        """
+        # will need to update if this has been idle for a while...
+        if self._needupdate or self.now != self.parent.now:
+            self.update(self.parent.now)
+
+        if is_zero( self._position ):
+            return 0., 0.
+
+        return self._book_transaction(-self._position)
 
     @cy.locals(q=cy.double, p=cy.double)
     def commission(self, q, p):
@@ -1517,9 +1900,13 @@ class SecurityBase(Node):
             * p (float): price
 
         """
+        # no need to call the default commission function - always 0
+        if self.parent._dflt_comm:
+            return 0.
         return self.parent.commission_fn(q, p)
 
-    @cy.locals(q=cy.double)
+    @cy.locals(q=cy.double, fee=cy.double, bidoffer=cy.double,
+               outlay=cy.double, unit=cy.double)
     def outlay(self, q, p=None):
         """
         Determines the complete cash outlay (including commission) necessary
@@ -1530,15 +1917,17 @@ class SecurityBase(Node):
             * q (float): quantity
             * p (float): price override
         """
+        # value of one unit of the security
+        unit = self._price * self.multiplier
         if p is None:
-            fee = self.commission(q, self._price * self.multiplier)
+            fee = self.commission(q, unit)
             bidoffer = abs(q) * 0.5 * self._bidoffer * self.multiplier
         else:
             # price override provided: custom transaction
             fee = self.commission(q, p * self.multiplier)
             bidoffer = q * (p - self._price) * self.multiplier
 
-        outlay = q * self._price * self.multiplier + bidoffer
+        outlay = q * unit + bidoffer
 
         return outlay + fee, outlay, fee, bidoffer
 
@@ -1582,7 +1971,7 @@ class FixedIncomeSecurity( SecurityBase ):
 
         # For fixed income securities (bonds, swaps), notional value is position size, not value!
         self._notl_value = self._position
-        self._notl_values.values[ inow ] = self._notl_value
+        self._notl_values_arr[inow] = self._notl_value
 
 
 class CouponPayingSecurity( FixedIncomeSecurity ):
@@ -1637,6 +2026,15 @@ class CouponPayingSecurity( FixedIncomeSecurity ):
         self.data['coupon'] = 0.
         self._coupon_income = self.data['coupon']
 
+        self._cache_arrays()
+
+    def _cache_arrays(self):
+        super(CouponPayingSecurity, self)._cache_arrays()
+        # coupon data is not there yet when called from SecurityBase.setup
+        if 'coupon' in self.data:
+            self._coupons_arr = self._coupons.values
+            self._coupon_income_arr = self._coupon_income.values
+
     @cy.locals(coupon=cy.double)
     def update(self, date, data=None, inow=None):
         """
@@ -1655,7 +2053,7 @@ class CouponPayingSecurity( FixedIncomeSecurity ):
         # Standard update
         super(CouponPayingSecurity, self).update( date, data, inow )
 
-        coupon = self._coupons.values[inow]
+        coupon = self._coupons_arr[inow]
         # If we were to call self.parent.adjust, then all the child weights would
         # need to be updated. If each security pays a coupon, then this happens for
         # each child. Instead, we store the coupon on self._capital, and it gets
@@ -1672,7 +2070,7 @@ class CouponPayingSecurity( FixedIncomeSecurity ):
             self._coupon = self._position * coupon
 
         self._capital = self._coupon
-        self._coupon_income.values[inow] = self._coupon
+        self._coupon_income_arr[inow] = self._coupon
 
     @property
     def coupon(self):
@@ -1693,7 +2091,7 @@ class CouponPayingSecurity( FixedIncomeSecurity ):
 
         if self.root.stale: # Stale check needed because coupon paid depends on position
             self.root.update(self.root.now, None)
-        return self._coupon_income.loc[:self.now]
+        return self._coupon_income.iloc[:self.inow + 1]
 
 
 class HedgeSecurity( SecurityBase ):
@@ -1714,7 +2112,7 @@ class HedgeSecurity( SecurityBase ):
         """
         super( HedgeSecurity, self ).update( date, data, inow )
         self._notl_value = 0.
-        self._notl_values.values.fill(0.)
+        self._notl_values_arr.fill(0.)
 
 
 class CouponPayingHedgeSecurity( CouponPayingSecurity ):
@@ -1735,7 +2133,7 @@ class CouponPayingHedgeSecurity( CouponPayingSecurity ):
         """
         super( CouponPayingHedgeSecurity, self ).update( date, data, inow )
         self._notl_value = 0.
-        self._notl_values.values.fill(0.)
+        self._notl_values_arr.fill(0.)
 
 
 class Algo(object):
@@ -1791,13 +2189,39 @@ class AlgoStack(Algo):
     def __init__(self, *algos):
         super(AlgoStack, self).__init__()
         self.algos = algos
-        self.check_run_always = any(hasattr(x, 'run_always')
-                                    for x in self.algos)
+
+        # single pass over the algos, which builds:
+        # - the calls - Algo objects' __call__ is bound up front, calling the
+        #   bound method skips the special method lookup algo(target) has to
+        #   go through. Plain functions are called directly
+        # - (algo call, run_always) pairs - saves the attribute checks on
+        #   each call
+        # - check_run_always - getattr with a default rather than hasattr,
+        #   no AttributeError to raise and swallow for algos without the
+        #   attribute. Algos with run_always set to False need no special
+        #   treatment either
+        calls = []
+        pairs = []
+        check_run_always = False
+        for x in algos:
+            if isinstance(x, Algo):
+                c = MethodType(type(x).__call__, x)
+            else:
+                c = x
+            run_always = bool(getattr(x, 'run_always', False))
+            if run_always:
+                check_run_always = True
+            calls.append(c)
+            pairs.append((c, run_always))
+
+        self._algo_calls = tuple(calls)
+        self._algo_pairs = tuple(pairs)
+        self.check_run_always = check_run_always
 
     def __call__(self, target):
         # normal running mode
         if not self.check_run_always:
-            for algo in self.algos:
+            for algo in self._algo_calls:
                 if not algo(target):
                     return False
             return True
@@ -1807,12 +2231,11 @@ class AlgoStack(Algo):
             # allows continuation to check for and run
             # algos that have run_always set to True
             res = True
-            for algo in self.algos:
+            for algo, run_always in self._algo_pairs:
                 if res:
                     res = algo(target)
-                elif hasattr(algo, 'run_always'):
-                    if algo.run_always:
-                        algo(target)
+                elif run_always:
+                    algo(target)
             return res
 
 
@@ -1851,15 +2274,40 @@ class Strategy(StrategyBase):
         self.perm = {}
 
     def run(self):
-        # clear out temp data
-        self.temp = {}
+        # run the algo stacks of this strategy and of all the strategies below
+        # it in one flat loop rather than recursively. The order is the same -
+        # a strategy runs before its children
+        order = self._run_order
+        if order is None:
+            order = self._run_order = self._build_run_order()
+
+        for run in order:
+            run()
+
+    def _run_algos(self):
+        # clear out temp data - reuse the dict rather than creating a new one
+        # on every run
+        self.temp.clear()
 
         # run algo stack
         self.stack(self)
 
-        # run children
-        for c in self._childrenv:
-            c.run()
+    def _build_run_order(self):
+        # pre-order walk of the strategy children - securities have nothing
+        # to do on run. Children that override run are left to it, including
+        # running their own children
+        order = []
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if (node is not self and
+                    not _is_inherited(type(node), Strategy, 'run')):
+                order.append(node.run)
+                continue
+            order.append(node._run_algos)
+            # reversed so that the children are popped in order
+            nodes.extend(reversed(node._strat_children_nodes))
+        return tuple(order)
 
 
 class FixedIncomeStrategy( Strategy ):
@@ -26,7 +26,9 @@ else:
 ext_modules = []
 
 if use_cython:
-    ext_modules = cythonize('bt/core.py')
+    # 3str - Python 3 semantics, but str stays the native str type
+    ext_modules = cythonize('bt/core.py',
+                            compiler_directives={'language_level': '3str'})
 else:
     ext_modules = [
         Extension('bt.core', ['bt/core.c'])
@@ -48,7 +50,7 @@ setup(
         'dev': [
             'codecov',
             'coverage',
-            'cython>=0.25',
+            'cython>=0.29',
             'future',
             'numpy>=1',
             'pandas>=0.19',
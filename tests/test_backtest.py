@@ -104,6 +104,35 @@ def test_turnover():
     assert np.allclose(t.turnover[dts[4]], 76100. / 1015285)
 
 
+def test_security_weights():
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['a', 'b'], data=100.)
+
+    s1 = bt.Strategy('s1', [bt.algos.SelectAll(),
+                            bt.algos.WeighEqually(),
+                            bt.algos.Rebalance()], ['a', 'b'])
+    s2 = bt.Strategy('s2', [bt.algos.SelectAll(),
+                            bt.algos.WeighEqually(),
+                            bt.algos.Rebalance()], ['a'])
+    s = bt.Strategy('s', [bt.algos.SelectAll(),
+                          bt.algos.WeighEqually(),
+                          bt.algos.Rebalance()], [s1, s2])
+
+    t = bt.Backtest(s, data, progress_bar=False)
+    bt.run(t)
+
+    w = t.security_weights
+    assert sorted(w.columns) == ['a', 'b']
+    assert list(w.index) == list(t.strategy.values.index)
+    # security held by both children is summed up
+    assert np.allclose(w['a'].iloc[1:], 0.75)
+    assert np.allclose(w['b'].iloc[1:], 0.25)
+    assert (w.iloc[0] == 0).all()
+
+    v = t.strategy.security_values
+    assert np.allclose(v.div(t.strategy.values, axis=0), w)
+
+
 def test_Results_helper_functions():
 
     names = ['foo', 'bar']
@@ -61,6 +61,20 @@ def test_strategybase_tree():
     assert s == s2.parent
 
 
+def test_strategybase_tree_parent():
+    s1 = SecurityBase('s1')
+    s = StrategyBase('p', [s1])
+
+    c = StrategyBase('c', ['a'], parent=s)
+
+    assert s['c'] is c
+    assert c.parent == s
+    assert c.root == s
+    assert c in s._strat_children_nodes
+    assert c not in s._sec_children
+    assert s.members == [s, s['s1'], c]
+
+
 def test_node_members():
     s1 = SecurityBase('s1')
     s2 = SecurityBase('s2')
@@ -84,6 +98,35 @@ def test_node_members():
     assert s2 in actual
 
 
+def test_node_members_new_child():
+    s1 = SecurityBase('s1')
+    c = StrategyBase('c', [s1])
+    m = StrategyBase('m', [c])
+
+    c = m['c']
+
+    assert len(m.members) == 3
+    assert len(c.members) == 2
+    assert len(m.securities) == 1
+
+    # adding a child further down the tree must be reflected in members
+    s2 = SecurityBase('s2')
+    c._add_child(s2)
+
+    actual = m.members
+    assert len(actual) == 4
+    assert s2 in actual
+    assert actual == [m, c, c['s1'], s2]
+
+    actual = m.securities
+    assert len(actual) == 2
+    assert s2 in actual
+
+    actual = c.members
+    assert len(actual) == 3
+    assert s2 in actual
+
+
 def test_node_full_name():
     s1 = SecurityBase('s1')
     s2 = SecurityBase('s2')
@@ -602,6 +645,39 @@ def test_strategybase_flatten():
     assert s.value == 1000
 
 
+def test_strategybase_flatten_commissions():
+    s = StrategyBase('s')
+
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['c1', 'c2'], data=100.)
+
+    s.set_commissions(lambda q, p: 1.)
+    s.setup(data)
+
+    s.update(dts[0])
+    s.adjust(1000)
+    s.allocate(201, 'c1')
+    s.allocate(201, 'c2')
+    c1 = s['c1']
+    c2 = s['c2']
+
+    assert c1.position == 2
+    assert c2.position == 2
+    assert s.value == 998
+    assert s.fees.iloc[-1] == 2
+
+    s.update(dts[1])
+    s.flatten()
+
+    assert c1.position == 0
+    assert c2.position == 0
+    assert s.capital == 996
+    assert s.value == 996
+    assert s.fees.iloc[-1] == 2
+    assert c1.outlays.iloc[-1] == -200
+    assert c2.outlays.iloc[-1] == -200
+
+
 def test_strategybase_multiple_calls():
     s = StrategyBase('s')
 
@@ -1737,6 +1813,26 @@ def test_algo_stack():
     assert a3.called
 
 
+def test_algo_stack_copy():
+    class CountAlgo(bt.core.Algo):
+        def __init__(self):
+            super(CountAlgo, self).__init__()
+            self.count = 0
+
+        def __call__(self, target):
+            self.count += 1
+            return True
+
+    a = CountAlgo()
+    stack = AlgoStack(a)
+    stack_copy = copy.deepcopy(stack)
+
+    # copies call their own algos
+    assert stack_copy(mock.MagicMock())
+    assert a.count == 0
+    assert stack_copy.algos[0].count == 1
+
+
 def test_set_commissions():
     s = StrategyBase('s')
 
@@ -1756,6 +1852,27 @@ def test_set_commissions():
     assert s.capital == 999
 
 
+def test_set_commission_fn():
+    s = StrategyBase('s')
+
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['c1', 'c2'], data=100)
+
+    s.setup(data)
+    s.update(dts[0])
+    s.adjust(1000)
+
+    # assigning the attribute directly works just like set_commissions
+    s.commission_fn = lambda x, y: 1.0
+    s.allocate(500, 'c1')
+    assert s.capital == 599
+
+    # back to default - no commissions
+    s.commission_fn = s._dflt_comm_fn
+    s.allocate(-400, 'c1')
+    assert s.capital == 999
+
+
 def test_strategy_tree_proper_return_calcs():
     s1 = StrategyBase('s1')
     s2 = StrategyBase('s2')
@@ -1851,6 +1968,101 @@ def test_strategy_tree_proper_universes():
     assert 'c' in child1._universe.columns
 
 
+def test_strategy_tree_universe_strategy_prices():
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['a', 'b'], data=100.)
+    data['b'].loc[dts[1]] = 101
+    data['b'].loc[dts[2]] = 102
+
+    s = Strategy('s',
+                 [bt.algos.SelectAll(),
+                  bt.algos.WeighEqually(),
+                  bt.algos.Rebalance()],
+                 ['b'])
+
+    m = Strategy('m', [], [s, 'a'])
+    s = m['s']
+
+    m.setup(data)
+
+    for dt in dts:
+        m.update(dt)
+        # read the universe in between updates, like algos do
+        universe = m.universe
+        assert universe['s'][dt] == s.price
+        m.run()
+        m.update(dt)
+
+    # reading the universe must not have moved the strategy children column
+    # away from the array update writes to
+    assert np.shares_memory(m._strat_children_arrs[0][1],
+                            m._universe['s'].values)
+
+    # strategy children prices are written to their column in the universe
+    assert m.universe['s'][dts[0]] == 100
+    assert np.isclose(m.universe['s'][dts[1]], 100. * (101 / 100.))
+    assert np.isclose(m.universe['s'][dts[2]], 100. * (102 / 100.))
+    assert np.allclose(m.universe['s'], s.prices)
+
+
+def test_strategy_tree_universe_strategy_name_in_data():
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['a', 'b', 's'], data=100.)
+    data['s'] = 50.
+
+    s = Strategy('s', [], ['b'])
+    m = Strategy('m', [], [s, 'a'])
+    s = m['s']
+
+    m.setup(data)
+
+    assert list(m._universe.columns) == ['a', 's']
+    assert m._universe['s'].isnull().all()
+
+    for dt in dts:
+        m.update(dt)
+
+    assert np.allclose(m.universe['s'], s.prices)
+
+
+def test_strategy_run_order():
+    calls = []
+
+    def record(name):
+        def algo(target):
+            calls.append((name, target.name))
+            return True
+        return algo
+
+    class CustomStrategy(Strategy):
+        def run(self):
+            calls.append(('custom', self.name))
+
+    s1 = Strategy('s1', [record('s1')], ['a'])
+    s2 = Strategy('s2', [record('s2')], [s1, 'b'])
+    s3 = Strategy('s3', [record('s3')])
+    s4 = CustomStrategy('s4', [record('s4')], [Strategy('s5', [record('s5')])])
+    m = Strategy('m', [record('m')], [s2, s3, s4])
+
+    # parents run before their children, children that override run are
+    # left to it
+    m.run()
+    assert calls == [('m', 'm'), ('s2', 's2'), ('s1', 's1'), ('s3', 's3'),
+                     ('custom', 's4')]
+
+    # new strategy children are picked up
+    calls = []
+    m['s3']._add_child(Strategy('s6', [record('s6')]))
+    m.run()
+    assert calls == [('m', 'm'), ('s2', 's2'), ('s1', 's1'), ('s3', 's3'),
+                     ('s6', 's6'), ('custom', 's4')]
+
+    # copies run their own strategies
+    m_copy = copy.deepcopy(m)
+    members = [id(x) for x in m_copy.members]
+    assert all(id(r.__self__) in members for r in m_copy._run_order)
+
+
 def test_strategy_tree_paper():
     dts = pd.date_range('2010-01-01', periods=3)
     data = pd.DataFrame(index=dts, columns=['a'], data=100.)
@@ -1874,6 +2086,13 @@ def test_strategy_tree_paper():
     assert s._paper_trade
     assert s._paper.price == 100
 
+    # paper is detached from the tree it was copied from
+    paper = s._paper
+    assert paper.parent is paper
+    assert paper.root is paper
+    assert not paper._paper_trade
+    assert all(x.root is paper for x in paper.members)
+
     s.update(dts[1])
     m.run()
 
@@ -1891,6 +2110,43 @@ def test_strategy_tree_paper():
     assert np.allclose(s.price, 100. * (102 / 101.))
 
 
+def test_strategy_tree_deepcopy_mid_run():
+    dts = pd.date_range('2010-01-01', periods=5)
+    data = pd.DataFrame(index=dts, columns=['a', 'b'], data=100.)
+    data['a'] = [100., 101., 102., 103., 104.]
+
+    def make():
+        c = Strategy('c', [bt.algos.SelectAll(),
+                           bt.algos.WeighEqually(),
+                           bt.algos.Rebalance()], ['a', 'b'])
+        m = Strategy('m', [bt.algos.SelectAll(),
+                           bt.algos.WeighEqually(),
+                           bt.algos.Rebalance()], [c, 'a'])
+        m.setup(data)
+        m.adjust(1000)
+        return m
+
+    m = make()
+    for dt in dts:
+        m.update(dt)
+        m.run()
+
+    m2 = make()
+    for i, dt in enumerate(dts):
+        # copies must keep recording after they are made
+        if i == 2:
+            m2 = copy.deepcopy(m2)
+        m2.update(dt)
+        m2.run()
+
+    assert np.allclose(m2.values, m.values)
+    assert np.allclose(m2.prices, m.prices)
+    assert np.allclose(m2['c'].prices, m['c'].prices)
+    assert np.allclose(m2['a'].values, m['a'].values)
+    assert np.allclose(m2['c']['a'].values, m['c']['a'].values)
+    assert np.allclose(m2.universe['c'], m.universe['c'])
+
+
 def test_outlays():
     c1 = SecurityBase('c1')
     c2 = SecurityBase('c2')
@@ -2059,6 +2315,31 @@ def test_degenerate_shorting():
         assert 'full_outlay should always be approaching amount' in str(e)
 
 
+def test_securitybase_allocate_bad_price():
+    c1 = SecurityBase('c1')
+    s = StrategyBase('p', [c1])
+
+    c1 = s['c1']
+
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['c1'], data=100.)
+    data['c1'][dts[1]] = np.nan
+    data['c1'][dts[2]] = 0.
+
+    s.setup(data)
+    s.adjust(1000)
+
+    for i in (1, 2):
+        s.update(dts[i])
+        try:
+            c1.allocate(100)
+            assert False
+        except Exception as e:
+            assert str(e).startswith('Cannot allocate capital to c1')
+
+    assert c1.position == 0
+
+
 def test_securitybase_allocate():
     c1 = SecurityBase('c1')
     s = StrategyBase('p', [c1])
@@ -2133,6 +2414,54 @@ def test_securitybase_allocate_commisions():
     res = bt.run(t)
     ########################
 
+def test_securitybase_allocate_commission_override():
+    class FlatFeeSecurity(SecurityBase):
+        def commission(self, q, p):
+            return 10.
+
+    c1 = FlatFeeSecurity('c1')
+    s = StrategyBase('p', [c1])
+
+    c1 = s['c1']
+
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['c1'], data=100.)
+
+    s.setup(data)
+    s.update(dts[0])
+    s.adjust(1000)
+
+    c1.allocate(1000)
+
+    # sized with the overridden commission
+    assert c1.position == 9
+    assert s.capital == 90
+
+
+def test_strategybase_dflt_comm_fn_override():
+    class FlatFeeStrategy(StrategyBase):
+        def _dflt_comm_fn(self, q, p):
+            return 1.
+
+    c1 = SecurityBase('c1')
+    s = FlatFeeStrategy('p', [c1])
+
+    c1 = s['c1']
+
+    dts = pd.date_range('2010-01-01', periods=3)
+    data = pd.DataFrame(index=dts, columns=['c1'], data=100.)
+
+    s.setup(data)
+    s.update(dts[0])
+    s.adjust(1000)
+
+    c1.allocate(500)
+
+    # the overridden default commission is charged
+    assert c1.position == 4
+    assert s.capital == 599
+
+
 def test_strategybase_tree_transact():
     c1 = SecurityBase('c1')
     c2 = SecurityBase('c2')
@@ -2412,6 +2741,77 @@ def test_security_setup_positions():
     assert c2.positions[0] == 0
 
 
+def test_strategybase_positions():
+    c1 = SecurityBase('c1')
+    c2 = SecurityBase('c2')
+    s = StrategyBase('p', [c1, c2])
+
+    c1 = s['c1']
+    c2 = s['c2']
+
+    dts = pd.date_range('2010-01-01', periods=4)
+    data = pd.DataFrame(index=dts, columns=['c1', 'c2'], data=100)
+
+    s.setup(data)
+
+    i = 0
+    s.update(dts[i])
+    s.adjust(1000)
+    s.allocate(500, 'c1')
+    s.allocate(500, 'c2')
+    s.update(dts[i])
+
+    i = 1
+    s.update(dts[i])
+    s.close('c2')
+    s.update(dts[i])
+
+    i = 2
+    s.update(dts[i])
+
+    # c2 is idle from here on, but should still show up as flat
+    i = 3
+    s.update(dts[i])
+
+    positions = s.positions
+    assert list(positions.columns) == ['c1', 'c2']
+    assert len(positions) == 4
+    assert list(positions['c1']) == [5, 5, 5, 5]
+    assert list(positions['c2']) == [5, 0, 0, 0]
+
+
+def test_security_prices_from_data():
+    c1 = SecurityBase('c1')
+    c2 = SecurityBase('c2')
+    s = StrategyBase('p', [c1, c2])
+
+    c1 = s['c1']
+    c2 = s['c2']
+
+    dts = pd.date_range('2010-01-01', periods=3)
+    # c1 prices are ints in universe, c2 prices are passed in with data
+    universe = pd.DataFrame(index=dts, columns=['c1'], data=100)
+    data = pd.DataFrame(index=dts, columns=['c1', 'c2'], data=100.)
+
+    s.setup(universe)
+
+    i = 0
+    s.update(dts[i], data.loc[dts[i]])
+    s.adjust(1000)
+    s.allocate(500, 'c1')
+    s.allocate(500, 'c2')
+    s.update(dts[i], data.loc[dts[i]])
+
+    assert isinstance(c1.price, float)
+    assert c2.prices.dtype == np.float64
+    assert c2.price == 100
+    assert c2.position == 5
+
+    positions = s.positions
+    assert list(positions['c1']) == [5]
+    assert list(positions['c2']) == [5]
+
+
 def test_couponpayingsecurity_setup():
     c1 = CouponPayingSecurity('c1')
     c2 = SecurityBase('c2')